@@ -0,0 +1,42 @@
+"""
+Accuracy check for compact mode against float64.
+
+Computes calc_vol columns for every stored security from float64 and from
+float32 prices and reports, per column, the largest difference and the
+share of values whose last rounded digit moved, along with the memory
+the closes panel takes in each mode. Fails if compact moves more than
+BUDGET of the values of any column.
+
+    python benchmarks/compact_accuracy.py data_files
+"""
+import sys
+import pandas as pd
+from analyze.macro_functions import get_price_panels
+from analyze.micro_functions import Stock, compact_accuracy
+from analyze.storage import catalog
+
+BUDGET = 0.01
+
+
+def main(folder='data_files'):
+    checks = [compact_accuracy(Stock(symbol, None, folder=folder).data)
+              for symbol in catalog(folder).symbols()]
+    if not checks:
+        sys.exit(f"no price files in {folder}")
+    combined = pd.concat(checks)
+    result = combined.groupby(level=0, sort=False).agg(
+        {'max_error': 'max', 'differ': 'mean'})
+    result['status'] = ['ok' if differ <= BUDGET else 'FAIL'
+                        for differ in result.differ]
+    print(f"{len(checks)} securities in {folder}")
+    print(result.to_string(formatters={'differ': '{:.3%}'.format}))
+
+    for compact in (False, True):
+        closes = get_price_panels(folder, ['close'], compact=compact)['close']
+        print(f"closes panel {'float32' if compact else 'float64'}: "
+              f"{closes.memory_usage(index=False).sum() / 2**10:,.0f} KiB")
+    sys.exit(1 if (result.status == 'FAIL').any() else 0)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,57 @@
+"""
+Import time benchmark for the analyze package.
+
+Imports each module in a fresh interpreter, reports the best of a few
+runs and fails if a module takes longer than its budget or pulls in a
+plotting or network library at import time.
+
+    python benchmarks/import_time.py
+"""
+import subprocess
+import sys
+
+RUNS = 5
+MODULES = {
+    'analyze.macro_functions': 1.0,
+    'analyze.micro_functions': 1.0,
+    'analyze.headless': 1.0,
+}
+LAZY = ['matplotlib', 'seaborn', 'eod', 'requests', 'xlsxwriter']
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(','.join(m for m in {lazy!r} if m in sys.modules))
+"""
+
+
+def measure(module):
+    times = []
+    for _ in range(RUNS):
+        out = subprocess.run([sys.executable, '-c',
+                              PROBE.format(module=module, lazy=LAZY)],
+                             capture_output=True, text=True, check=True)
+        seconds, loaded = out.stdout.splitlines()
+        times.append(float(seconds))
+    return min(times), [m for m in loaded.split(',') if m]
+
+
+def main():
+    failed = False
+    for module, budget in MODULES.items():
+        seconds, loaded = measure(module)
+        status = 'ok'
+        if seconds > budget or loaded:
+            status = 'FAIL'
+            failed = True
+        print(f"{module:<28}{seconds * 1000:8.1f} ms  budget "
+              f"{budget * 1000:.0f} ms  {status}")
+        if loaded:
+            print(f"    imported eagerly: {', '.join(loaded)}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
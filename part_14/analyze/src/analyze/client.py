@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+EOD_URL = "https://eodhistoricaldata.com/api"
+CACHE_DIR = os.environ.get('ANALYZE_CACHE', '.eod_cache')
+
+# seconds a cached response stays fresh, by first part of the endpoint path
+TTL = {
+    'exchange-symbol-list': 7 * 86400,
+    'fundamentals': 86400,
+    'calendar': 6 * 3600,
+    'eod-bulk-last-day': 6 * 3600,
+    'eod': 6 * 3600,
+}
+DEFAULT_TTL = 3600
+# statuses worth retrying, anything else in 4xx is treated as permanent
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class CacheMiss(LookupError):
+    """
+    raised in offline mode when a response is not cached
+    """
+
+
+class ApiError(Exception):
+    """
+    raised when a call fails; retryable tells if trying again may succeed
+    """
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class RateLimiter:
+    """
+    token bucket allowing rate calls per second with bursts of up to burst
+    shared by every thread using the same client
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        blocks until a call may be made
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class Results:
+    """
+    outcome of a batch of calls: symbols that worked and why others failed
+    symbols that worked but had nothing new are kept apart as current
+    """
+    def __init__(self):
+        self.succeeded = []
+        self.current = []
+        self.failed = {}
+
+    def add(self, symbol, error=None, updated=True):
+        if error is not None:
+            self.failed[symbol] = error
+        elif updated:
+            self.succeeded.append(symbol)
+        else:
+            self.current.append(symbol)
+
+    def retryable(self):
+        """
+        returns symbols whose failure was transient, worth running again
+        """
+        return [symbol for symbol, error in self.failed.items()
+                if getattr(error, 'retryable', False)]
+
+    def summary(self):
+        print(f"Data download for {len(self.succeeded)} securities")
+        if self.current:
+            print(f"{len(self.current)} already up to date")
+        print(f"{len(self.failed)} tickers skipped")
+        if self.failed:
+            print(" Tickers skipped ".center(30, "="))
+            for symbol, error in self.failed.items():
+                print(f"{symbol}: {error}")
+
+
+class ResponseCache:
+    """
+    disk cache of api responses keyed by endpoint and parameters
+    entries expire after the ttl of their endpoint; once the folder grows
+    past max_bytes the least recently used entries are removed
+    offline serves only cached responses, stale or not, and never calls the api
+    CACHE is the instance clients share by default; pass
+    ResponseCache(offline=True) as cache to a client, or to the macro
+    functions, to work offline, or set CACHE.offline for every default client
+    """
+    def __init__(self, folder=CACHE_DIR, max_bytes=500 * 2**20, ttl=None,
+                 offline=False):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.ttl = {**TTL, **(ttl or {})}
+        self.offline = offline
+
+    def _file(self, path, params):
+        params = {k: str(v) for k, v in params.items() if k != 'api_token'}
+        name = json.dumps([path, sorted(params.items())])
+        return f"{self.folder}/{hashlib.sha1(name.encode()).hexdigest()}.json"
+
+    def get(self, path, params):
+        """
+        returns cached response or None when missing or expired
+        """
+        file = self._file(path, params)
+        try:
+            with open(file) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            if self.offline:
+                raise CacheMiss(f"{path} is not cached")
+            return None
+        ttl = self.ttl.get(path.split('/')[0], DEFAULT_TTL)
+        if not self.offline and time.time() - entry['stored'] > ttl:
+            return None
+        os.utime(file)
+        return entry['body']
+
+    def put(self, path, params, body):
+        """
+        stores response and evicts least recently used entries over max_bytes
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        file = self._file(path, params)
+        temp = f"{file}.{os.getpid()}.tmp"
+        with open(temp, 'w') as f:
+            json.dump({'stored': time.time(), 'path': path, 'body': body}, f)
+        os.replace(temp, file)
+        self.evict()
+
+    def evict(self):
+        """
+        removes least recently used entries until the cache fits max_bytes
+        """
+        entries = [entry for entry in os.scandir(self.folder)
+                   if entry.name.endswith('.json')]
+        size = sum(entry.stat().st_size for entry in entries)
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            if size <= self.max_bytes:
+                break
+            size -= entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """
+        removes every cached response
+        """
+        if os.path.exists(self.folder):
+            for entry in os.scandir(self.folder):
+                if entry.name.endswith('.json'):
+                    os.remove(entry.path)
+
+
+CACHE = ResponseCache()
+
+
+class EodClient:
+    """
+    json client for the eodhistoricaldata api sharing one pooled session
+    responses go through cache; pass cache=None to always call the api, or
+    a ResponseCache with offline=True to never call it
+    rate caps calls per second; transient failures are retried up to retries
+    times with exponential backoff and jitter, permanent ones raise at once
+    """
+    def __init__(self, key, cache=CACHE, pool_size=10, rate=None, retries=3,
+                 backoff=0.5):
+        self.key = key
+        self.cache = cache
+        self.limiter = RateLimiter(rate) if rate else None
+        self.retries = retries
+        self.backoff = backoff
+        import requests
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+
+    def get(self, path, params=None, cache=True):
+        """
+        returns decoded json from endpoint path, e.g. 'eod/AAPL'
+        """
+        params = {k: str(v) for k, v in (params or {}).items()}
+        use_cache = cache and self.cache is not None
+        if use_cache:
+            body = self.cache.get(path, params)
+            if body is not None:
+                return body
+        body = self._call(path, params)
+        if use_cache:
+            self.cache.put(path, params, body)
+        return body
+
+    def _call(self, path, params):
+        import requests
+        for attempt in range(self.retries + 1):
+            wait = None
+            try:
+                if self.limiter:
+                    self.limiter.acquire()
+                response = self.session.get(
+                    f"{EOD_URL}/{path}",
+                    params={**params, 'api_token': self.key, 'fmt': 'json'},
+                    timeout=300)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = ApiError(f"{type(e).__name__} on {path}",
+                                 retryable=True)
+            else:
+                if response.ok:
+                    try:
+                        return response.json()
+                    except ValueError:
+                        raise ApiError(f"invalid json from {path}")
+                retryable = response.status_code in RETRY_STATUS
+                error = ApiError(f"HTTP {response.status_code} on {path}",
+                                 response.status_code, retryable)
+                if not retryable:
+                    raise error
+                wait = response.headers.get('Retry-After')
+            if attempt == self.retries:
+                raise error
+            if wait is not None and wait.isdigit():
+                time.sleep(int(wait))
+            else:
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,220 @@
+import numpy as np
+import pandas as pd
+
+
+def _result(shape, dtype, out):
+    """
+    returns array to fill with results, memory mapped to out when given
+    """
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    return np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=shape)
+
+
+def standardize(data):
+    """
+    returns dates where every column has a value, scaled so that the
+    product of two columns summed over the dates is their correlation
+    with fewer than 2 such dates there is nothing to correlate and a single
+    row of NaN is returned instead, so every product is NaN
+    """
+    values = np.asarray(data, dtype='float64')
+    values = values[~np.isnan(values).any(axis=1)]
+    if len(values) < 2:
+        return np.full((1, values.shape[1]), np.nan)
+    values = values - values.mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return values / np.sqrt((values ** 2).sum(axis=0))
+
+
+def _centered(data):
+    """
+    returns values less their column means with gaps set to 0, and the mask
+    of values present; centering keeps the sums of squares from cancelling
+    """
+    values = np.asarray(data, dtype='float64')
+    valid = ~np.isnan(values)
+    # empty columns get a mean of 0 rather than a warning
+    count = valid.sum(axis=0)
+    mean = np.nansum(values, axis=0) / np.maximum(count, 1)
+    x = np.where(valid, values - mean, 0.0)
+    return x, valid.astype('float64')
+
+
+def _pairwise_rows(x, mask, start, stop):
+    """
+    returns correlations of columns start to stop with every column, each
+    pair over the dates both have values for
+    """
+    count = mask[:, start:stop].T @ mask
+    sum_i = x[:, start:stop].T @ mask
+    sum_j = mask[:, start:stop].T @ x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = x[:, start:stop].T @ x - sum_i * sum_j / count
+        var_i = (x[:, start:stop] ** 2).T @ mask - sum_i ** 2 / count
+        var_j = mask[:, start:stop].T @ x ** 2 - sum_j ** 2 / count
+        corr = np.clip(cov / np.sqrt(var_i * var_j), -1, 1)
+    corr[count < 2] = np.nan
+    return corr
+
+
+def corr_matrix(data, missing='pairwise', block=512, dtype='float64',
+                out=None):
+    """
+    returns correlation matrix of the columns of a returns frame
+    built block by block of columns from BLAS matrix products
+    missing='common' uses only dates where every column has a value,
+    missing='pairwise' uses the dates each pair shares, like DataFrame.corr
+    dtype='float32' halves the result; out is a .npy path to write it to
+    as a memory mapped file for universes too large to hold in memory
+    """
+    columns = data.columns
+    n = len(columns)
+    result = _result((n, n), dtype, out)
+    if missing == 'common':
+        z = standardize(data)
+        for start in range(0, n, block):
+            result[start:start + block] = z[:, start:start + block].T @ z
+    elif missing == 'pairwise':
+        x, mask = _centered(data)
+        for start in range(0, n, block):
+            result[start:start + block] = _pairwise_rows(x, mask, start,
+                                                         start + block)
+    else:
+        raise ValueError("missing must be 'common' or 'pairwise'")
+    # a column correlates with itself only if it varies over its dates
+    values = data.dropna() if missing == 'common' else data
+    diagonal = np.arange(n)
+    result[diagonal, diagonal] = np.where(
+        (values.max() > values.min()).to_numpy(), 1.0, np.nan)
+    if out is not None:
+        result.flush()
+    return pd.DataFrame(result, index=columns, columns=columns, copy=False)
+
+
+def _window_sums(x, mask):
+    """
+    returns pair counts, sums, sums of squares and cross products of rows
+    """
+    return mask.T @ mask, x.T @ mask, (x ** 2).T @ mask, x.T @ x
+
+
+def _from_sums(count, sum_x, sum_x2, cross, min_periods, cov):
+    """
+    returns correlation, or covariance with cov, from window sums
+    """
+    sum_y = sum_x.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        co = cross - sum_x * sum_y / count
+        if cov:
+            result = co / (count - 1)
+        else:
+            var_x = sum_x2 - sum_x ** 2 / count
+            var_y = sum_x2.T - sum_y ** 2 / count
+            result = np.clip(co / np.sqrt(var_x * var_y), -1, 1)
+    result[count < max(min_periods, 2)] = np.nan
+    return result
+
+
+def _top_pairs(result, date, columns, top_k, upper):
+    values = result[upper]
+    values = np.where(np.isnan(values), -np.inf, values)
+    k = min(top_k, len(values))
+    best = np.argpartition(-values, k - 1)[:k]
+    best = best[np.argsort(-values[best])]
+    return [(date, columns[upper[0][i]], columns[upper[1][i]], values[i])
+            for i in best if np.isfinite(values[i])]
+
+
+def rolling_corr(data, window=63, top_k=None, cov=False, min_periods=None,
+                 out=None):
+    """
+    returns rolling correlation, or covariance with cov, of every pair of
+    columns of a returns frame; sums of the window are updated as it slides,
+    so each date costs O(N^2) instead of recomputing the whole window
+    the result is a dates x N x N array lined up with data.index, written
+    to a memory mapped .npy file when out is given; top_k instead returns
+    only the k most correlated pairs for each date as a frame
+    """
+    columns = data.columns
+    values = np.asarray(data, dtype='float64')
+    t, n = values.shape
+    min_periods = window if min_periods is None else min_periods
+    valid = ~np.isnan(values)
+    mask = valid.astype('float64')
+    # centering first keeps the running sums from cancelling
+    x = np.where(valid, values - np.nanmean(values, axis=0), 0.0)
+
+    result = None if top_k else _result((t, n, n), 'float64', out)
+    upper = np.triu_indices(n, 1)
+    pairs = []
+    sums = [np.zeros((n, n)) for _ in range(4)]
+    for row in range(t):
+        if row % window == 0 and row >= window:
+            # rebuild from the window now and then so rounding cannot drift
+            sums = list(_window_sums(x[row - window + 1:row + 1],
+                                     mask[row - window + 1:row + 1]))
+        else:
+            added = _window_sums(x[row:row + 1], mask[row:row + 1])
+            for total, value in zip(sums, added):
+                total += value
+            if row >= window:
+                dropped = _window_sums(x[row - window:row - window + 1],
+                                       mask[row - window:row - window + 1])
+                for total, value in zip(sums, dropped):
+                    total -= value
+        current = _from_sums(*sums, min_periods, cov)
+        if top_k:
+            pairs += _top_pairs(current, data.index[row], columns, top_k,
+                                upper)
+        else:
+            result[row] = current
+    if top_k:
+        return pd.DataFrame(pairs, columns=['date', 'first', 'second',
+                                            'cov' if cov else 'corr'])
+    if out is not None:
+        result.flush()
+    return result
+
+
+def top_pairs(data, k=10, least=False, missing='pairwise', block=512):
+    """
+    returns edge list of the k most correlated securities for each security,
+    or the k least correlated with least, without building the full matrix
+    only a block of rows of the matrix exists at a time and each row keeps
+    just its k best neighbours; securities with fewer than 2 returns are
+    left out, they correlate with nothing and would empty the common dates
+    """
+    data = data.loc[:, data.notna().sum().to_numpy() >= 2]
+    columns = data.columns
+    n = len(columns)
+    k = min(k, n - 1)
+    if k < 1:
+        return pd.DataFrame([], columns=['symbol', 'neighbour', 'rank', 'corr'])
+    if missing == 'common':
+        z = standardize(data)
+    elif missing == 'pairwise':
+        x, mask = _centered(data)
+    else:
+        raise ValueError("missing must be 'common' or 'pairwise'")
+    sign = 1 if least else -1
+    edges = []
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        if missing == 'common':
+            corr = z[:, start:stop].T @ z
+        else:
+            corr = _pairwise_rows(x, mask, start, stop)
+        rows = np.arange(stop - start)
+        corr[rows, rows + start] = np.nan
+        keys = np.where(np.isnan(corr), np.inf, sign * corr)
+        best = np.argpartition(keys, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(keys, best, axis=1).argsort(axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        for row in rows:
+            for rank, neighbour in enumerate(best[row], 1):
+                value = corr[row, neighbour]
+                if not np.isnan(value):
+                    edges.append((columns[start + row], columns[neighbour],
+                                  rank, value))
+    return pd.DataFrame(edges, columns=['symbol', 'neighbour', 'rank', 'corr'])
@@ -0,0 +1,60 @@
+from analyze.plotting import headless
+headless()
+
+import argparse
+import os
+from analyze.macro_functions import bulk_append, get_closing_prices, get_data
+from analyze.storage import price_files
+
+
+def _key(args):
+    """
+    returns api key from --key, the EOD_API_KEY variable or api_token.txt
+    """
+    key = args.key or os.environ.get('EOD_API_KEY')
+    if key:
+        return key
+    with open('api_token.txt') as f:
+        return f.read().strip()
+
+
+def main(argv=None):
+    """
+    entry point for scheduled jobs; matplotlib, if anything loads it,
+    renders off screen so no display is ever needed
+    closes FOLDER           rebuild 0-closes from the price files in FOLDER
+    update FOLDER TICKERS   download only bars newer than the stored ones,
+                            for every ticker stored as --fmt if none given
+    bulk FOLDER             append the latest bar of every stored ticker
+    """
+    parser = argparse.ArgumentParser(prog='analyze-headless')
+    parser.add_argument('command', choices=['closes', 'update', 'bulk'])
+    parser.add_argument('folder')
+    parser.add_argument('tickers', nargs='*')
+    parser.add_argument('--key')
+    parser.add_argument('--fmt', default='csv')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--adj-close', action='store_true')
+    parser.add_argument('--compact', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'closes':
+        get_closing_prices(args.folder, adj_close=args.adj_close,
+                           workers=args.workers, fmt=args.fmt,
+                           compact=args.compact)
+    elif args.command == 'update':
+        tickers = args.tickers
+        if not tickers and os.path.isdir(args.folder):
+            tickers = [os.path.splitext(file)[0]
+                       for file in price_files(args.folder)
+                       if file.endswith(f".{args.fmt}")]
+        get_data(*tickers, key=_key(args), path=args.folder,
+                 workers=args.workers, incremental=True, fmt=args.fmt,
+                 compact=args.compact)
+    else:
+        bulk_append(_key(args), path=args.folder, fmt=args.fmt,
+                    workers=args.workers, compact=args.compact)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,38 @@
+from analyze.client import CACHE, ApiError, EodClient, Results
+from analyze.correlation import corr_matrix
+from analyze.panel import read_panel, save_panel
+from analyze.plotting import percent_formatter, pyplot
+from analyze.returns import log_returns, panel_returns
+from analyze.storage import (FORMATS, append_table, catalog, last_date,
+                             price_file, price_files, read_table, read_tables,
+                             write_table)
+from concurrent.futures import ThreadPoolExecutor
 import datetime as dt
-from eod import EodHistoricalData
-import json
+import functools
 import math
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mtick
 import numpy as np
 import os
 import pandas as pd
-import requests
+import time
 
 DEFAULT_DATE = dt.date.today() - dt.timedelta(396)
 TODAY =dt.date.today()
+RETURN_SHEETS = ['closes', 'returns', 'pct change']
+SP_FILE = os.path.join(os.path.dirname(__file__), 'data', 'sp500.csv')
 
 
 
-def get_exchange_data(key, exchange='NYSE'):
+def get_exchange_data(key, exchange='NYSE', cache=CACHE):
     """
     returns metadata for a specific exchange
     available: US, NASDAQ, OTCBB, PINK, BATS
+    cache is the ResponseCache to use, ResponseCache(offline=True) reads
+    only cached responses and None always calls the api
     """
-    endpoint = f"https://eodhistoricaldata.com/api/exchange-symbol-list/"
-    endpoint += f"{exchange}?api_token={key}&fmt=json"
     print("Downloading data")
-    call =requests.get(endpoint).text
-    exchange_data = pd.DataFrame(json.loads(call))
+    with EodClient(key, cache=cache) as client:
+        exchange_data = pd.DataFrame(
+            client.get(f"exchange-symbol-list/{exchange}"))
     print("Completed")
     return exchange_data
 
@@ -36,6 +45,30 @@ def get_security_type(exchange_data, type= "Common Stock"):
     symbols = exchange_data[exchange_data.Type == type]
     return symbols.Code.to_list()
 
+class SPMetadata:
+    """
+    S&P 500 metadata with sectors as a categorical column, a symbol to
+    sector mapping and the row positions and symbols of every sector
+    """
+    def __init__(self, data):
+        data['Sector'] = data['Sector'].astype('category')
+        self.data = data
+        self.sector_of = dict(zip(data['Symbol'], data['Sector']))
+        codes = data['Sector'].cat.codes.to_numpy()
+        self.rows = {sector: np.flatnonzero(codes == code)
+                     for code, sector in enumerate(data['Sector'].cat.categories)}
+        self.symbols = {sector: data['Symbol'].to_numpy()[rows]
+                        for sector, rows in self.rows.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def sp_metadata():
+    """
+    returns SPMetadata read once from the sp500.csv shipped with the package
+    """
+    return SPMetadata(pd.read_csv(SP_FILE))
+
+
 def get_sp(symbols =True, sector= False):
     """
     returns S&P 500 metadata
@@ -43,95 +76,236 @@ def get_sp(symbols =True, sector= False):
     Energy, Financials, Health Care, Industrials, Information Technology,
     Materials, Real Estate, Utilities
     """
-    sp = pd.read_csv('sp500.csv')
+    sp = sp_metadata().data
     if sector:
-        sp = sp[sp.Sector == sector]
+        sp = sp.iloc[sp_metadata().rows.get(sector, [])]
     if symbols:
-        return sp['Symbol']
+        return sp['Symbol'].copy()
     else:
-        return sp 
+        return sp.copy()
+
+
+def by_sector(data, func='mean'):
+    """
+    returns wide frame aggregated from symbol columns to sector columns
+    func is any groupby aggregation, e.g. mean, median or sum
+    symbols outside the S&P 500 are left out
+    """
+    sectors = pd.Series(data.columns, index=data.columns).map(
+        sp_metadata().sector_of)
+    return data.loc[:, sectors.notna().to_numpy()].T.groupby(
+        sectors.dropna(), observed=True).agg(func).T
+
+
+def _save_prices(prices, ticker, path, fmt='csv', compact=False):
+    """
+    stores downloaded bars for ticker indexed by date
+    """
+    df = pd.DataFrame(prices)
+    df.index = pd.DatetimeIndex(df.date)
+    df.drop(columns=['date'], inplace=True)
+    write_table(df, price_file(path, ticker, fmt), compact=compact)
 
 
-def get_data(*tickers, key, path='data_files', date=DEFAULT_DATE):
+def _append_prices(prices, ticker, path, fmt='csv', compact=False):
     """
-    downloads and stores as csv price data for selected securities
+    appends downloaded bars newer than those stored for ticker
     """
-    if not os.path.exists(f"{os.getcwd()}/{path}"):
-        os.mkdir(path)
-    downloaded = 0
-    skipped = 0
-    tickers_skipped = []
+    df = pd.DataFrame(prices)
+    df.index = pd.DatetimeIndex(df.date)
+    df.drop(columns=['date'], inplace=True)
+    return append_table(df, price_file(path, ticker, fmt), compact)
 
-    client = EodHistoricalData(key)
-    for ticker in tickers:
+
+def get_data(*tickers, key, path='data_files', date=DEFAULT_DATE, workers=1,
+             incremental=False, fmt='csv', rate=None, retries=3,
+             compact=False):
+    """
+    downloads and stores price data for selected securities
+    fmt is csv, parquet or feather
+    workers sets how many downloads run at once over a shared session
+    incremental only requests bars newer than those already stored
+    rate caps api calls per second, transient failures are retried
+    compact stores float32 prices and 32 bit volume, see storage.downcast
+    returns Results listing the tickers downloaded and why others failed
+    """
+    os.makedirs(path, exist_ok=True)
+    results = Results()
+
+    def download(ticker):
+        file = price_file(path, ticker, fmt)
         try:
-            print(f"Downloading {ticker}")
-            df = pd.DataFrame(client.get_prices_eod(ticker, from_=date))
-            df.index = pd.DatetimeIndex(df.date)
-            df.drop(columns=['date'], inplace=True)
-            df.to_csv(f"{path}/{ticker}.csv")
-            downloaded += 1
-        except:
-            print(f"{ticker} not found, skipping...")
-            skipped += 1
-            tickers_skipped.append(ticker)
+            last = None
+            if incremental and os.path.exists(file):
+                last = last_date(file)
+            if last is None:
+                print(f"Downloading {ticker}")
+                prices = client.get(f"eod/{ticker}", {'from': date},
+                                    cache=False)
+                if not prices:
+                    raise ApiError(f"no data for {ticker}")
+                _save_prices(prices, ticker, path, fmt, compact)
+            else:
+                print(f"Updating {ticker} from {last.date()}")
+                start = (last + dt.timedelta(1)).date()
+                prices = client.get(f"eod/{ticker}", {'from': start},
+                                    cache=False)
+                if prices:
+                    _append_prices(prices, ticker, path, fmt, compact)
+            return None
+        except Exception as e:
+            print(f"{ticker} failed, skipping: {e}")
+            return e
+
+    with EodClient(key, pool_size=workers, rate=rate, retries=retries) \
+            as client, ThreadPoolExecutor(max_workers=workers) as pool:
+        for ticker, error in zip(tickers, pool.map(download, tickers)):
+            results.add(ticker, error)
     print("Download completed")
-    print(f"Data download for {downloaded} securities")
-    print(f"{skipped} tickers skipped")
-    if tickers_skipped:
-        print(" Tickers skipped ".center(30, "="))
-        for ticker in tickers_skipped:
-            print(ticker)                         
+    results.summary()
+    return results
+
+
+def bulk_append(key, path='data_files', exchange='US', date=None, fmt='csv',
+                symbols=None, workers=1, compact=False):
+    """
+    appends the latest bar of every stored security from one bulk call
+    only securities that already have a price file in path are updated,
+    symbols limits the update further; date picks an earlier trading day
+    compact keeps parquet and feather files in downcast dtypes
+    returns Results listing the tickers appended, those already holding the
+    bar and why others failed
+    """
+    params = {} if date is None else {'date': date}
+    with EodClient(key) as client:
+        bars = pd.DataFrame(client.get(f"eod-bulk-last-day/{exchange}", params,
+                                       cache=False))
+    if bars.empty:
+        # a holiday or a date without data, nothing was received
+        bars = pd.DataFrame(columns=['code', 'date'])
+    stored = {os.path.splitext(file)[0]: file for file in price_files(path)
+              if file.endswith(f".{fmt}")}
+    if symbols is not None:
+        stored = {s: stored[s] for s in symbols if s in stored}
+    bars = bars[bars.code.isin(list(stored))]
+    bars = bars.drop(columns=['exchange_short_name', 'prev_close', 'change',
+                              'change_p'], errors='ignore')
+    bars.index = pd.DatetimeIndex(bars.pop('date'), name='date')
+    results = Results()
+
+    def append(group):
+        code, df = group
+        try:
+            rows = append_table(df.drop(columns=['code']),
+                                f"{path}/{stored[code]}", compact)
+            return code, None, rows > 0
+        except Exception as e:
+            return code, e, False
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for code, error, updated in pool.map(append,
+                                             bars.groupby('code', sort=False)):
+            results.add(code, error, updated)
+    received = set(bars.code)
+    for code in stored:
+        if code not in received:
+            results.add(code, LookupError(f"{code} not in bulk response"))
+    print(f"Bulk update of {exchange} completed")
+    results.summary()
+    return results
+
+
+def _build_panels(folder, files, columns, workers, processes=False,
+                  chunksize=None, compact=False):
+    """
+    returns dict of wide frames, one per column, with a column per file
+    files are parsed concurrently by read_tables and aligned once on all
+    their dates; compact builds float32 panels
+    """
+    dtype = 'float32' if compact else 'float64'
+    frames = read_tables([f"{folder}/{file}" for file in files], columns,
+                         workers, processes, chunksize, compact)
+    frames = [df[columns].astype(dtype) for df in frames]
+
+    if frames:
+        # dates keep the order they are first seen in, like a concat loop
+        dates = pd.Index(pd.unique(np.concatenate(
+            [df.index.to_numpy() for df in frames])), name='date')
+    else:
+        dates = pd.Index([], name='date')
+    values = np.full((len(columns), len(dates), len(frames)), np.nan,
+                     dtype=dtype)
+    for i, df in enumerate(frames):
+        values[:, dates.get_indexer(df.index), i] = df.to_numpy().T
+
+    symbols = [os.path.splitext(file)[0] for file in files]
+    return {column: pd.DataFrame(values[j], index=dates, columns=symbols)
+            for j, column in enumerate(columns)}
 
 
-def get_closing_prices(folder= 'data_files', adj_close= False):
+def get_closing_prices(folder= 'data_files', adj_close= False, workers=1,
+                       fmt='csv', processes=False, chunksize=None,
+                       compact=False):
     """
     returns file with closing prices for selected securities
+    files are parsed on workers threads, or processes, and aligned once on
+    all their dates
+    fmt sets the format of the 0-closes file, npy stores a date sorted
+    panel that load_panel opens memory mapped
+    compact keeps closes in float32, in memory and in the file
     """
-    files = [file for file in os.listdir(folder) if not file.startswith('0')]
-
-    closes = pd.DataFrame()
-
-    for file in files:
-        if adj_close:
-            df = pd.DataFrame(pd.read_csv(f"{folder}/{file}",
-                            index_col = 'date')['adjusted_close'])
-            df.rename(columns={'adjusted_close': file[:-4]}, inplace=True)
-        else:
-            df = pd.DataFrame(pd.read_csv(f"{folder}/{file}",
-                            index_col = 'date')['close'])
-            df.rename(columns={'close': file[:-4]}, inplace=True)
-
-        if closes.empty:
-            closes = df
-        else:
-            closes = pd.concat([closes, df], axis = 1)
-    closes.to_csv(f"{folder}/0-closes.csv")
+    start = time.perf_counter()
+    files = catalog(folder).files()
+    column = 'adjusted_close' if adj_close else 'close'
+    closes = _build_panels(folder, files, [column], workers, processes,
+                           chunksize, compact)[column]
+    if fmt == 'npy':
+        save_panel(closes.sort_index(), f"{folder}/0-closes.npy")
+    else:
+        write_table(closes, f"{folder}/0-closes.{fmt}")
+    print(f"Closes for {len(files)} securities built in "
+          f"{time.perf_counter() - start:.2f}s")
     return closes                                                                        
 
+
+def get_price_panels(folder= 'data_files',
+                     columns=('open', 'high', 'low', 'close'), workers=1,
+                     processes=False, chunksize=None, compact=False):
+    """
+    returns dict of wide date by symbol frames, one per price column
+    e.g. as input for micro_functions.calc_vol_panel
+    compact returns float32 panels
+    """
+    return _build_panels(folder, catalog(folder).files(), list(columns), workers,
+                         processes, chunksize, compact)
+
 def returns_from_closes(folder, filename):
     """
     returns instantaneous returns for selected securities
+    gaps stay in their own column, only dates without any return are dropped
     """
     try:
-        data = pd.read_csv(f"{folder}/{filename}", index_col=['date'])
-        
+        data = read_panel(f"{folder}/{filename}")
     except Exception as e:
-        print(f"There was a problem: {e}")            
-    return np.log(data).diff().dropna()
+        print(f"There was a problem: {e}")
+        return None
+    return log_returns(data)
 
-def get_corr(data):
+def get_corr(data, missing='pairwise', block=512, dtype='float64', out=None):
     """
     returns correl from securities
+    missing='common' only uses dates with returns for every security,
+    dtype='float32' and an out .npy path help with very large universes
     """
-    return data.corr()
+    return corr_matrix(data, missing, block, dtype, out)
 
 def plot_closes(closes, relative=False):
     """
     plot absolute or relative closes for securities
     """
-    if closes.endswith('.csv'):
-        closes = pd.read_csv(closes, index_col=['date'])
+    plt = pyplot()
+    if os.path.splitext(closes)[1] in FORMATS or closes.endswith('.npy'):
+        closes = read_panel(closes)
     else:
         closes = pd.read_excel(closes, index_col=['date'])
     if relative:
@@ -145,62 +319,131 @@ def plot_closes(closes, relative=False):
         plt.grid(axis='y')
         plt.show()            
 
-def get_return_data(*tickers, date=DEFAULT_DATE, adj_close=False, key):
+def get_return_data(*tickers, date=DEFAULT_DATE, adj_close=False, key,
+                    rate=None, output='xlsx', path='returns', cache=CACHE):
     """
     saves closes and returns out to excel file named returns
+    output parquet or feather saves them as binary files instead, see
+    save_returns; cache as for get_exchange_data
     """
-    client = EodHistoricalData(key)
+    results = Results()
     temp = pd.DataFrame()
 
-    for ticker in tickers:
-        try:
-            if adj_close:
-                temp[ticker] = pd.DataFrame(client.get_prices_eod(ticker,
-                from_=date))['adjusted_close']
-            else:
-                temp[ticker] = pd.DataFrame(client.get_prices_eod(ticker,
-                from_=date))['close']
-        except Exception as e:
-            print(f"{ticker} had a problem: {e}")
+    with EodClient(key, cache=cache, rate=rate) as client:
+        for ticker in tickers:
+            try:
+                if adj_close:
+                    temp[ticker] = pd.DataFrame(client.get(f"eod/{ticker}",
+                    {'from': date}))['adjusted_close']
+                else:
+                    temp[ticker] = pd.DataFrame(client.get(f"eod/{ticker}",
+                    {'from': date}))['close']
+                results.add(ticker)
+            except Exception as e:
+                print(f"{ticker} had a problem: {e}")
+                results.add(ticker, e)
+    results.summary()
     data = temp
-    data_instanteous = np.log(data).diff().dropna()
-    data_pct = data.pct_change()
-
-    with pd.ExcelWriter('returns.xlsx', datetime_format='yyyy-mm-dd') as writer:
-        data.to_excel(writer, sheet_name='closes')
-        data_instanteous.to_excel(writer, sheet_name='returns')
-        data_pct.to_excel(writer, sheet_name='pct change')
+    returns = panel_returns(data, ('log', 'simple'))
+    data_instanteous = returns['log', 1].dropna(how='all')
+    data_pct = returns['simple', 1]
 
-    print(f"Data retrieved and saved to returns.xlsx in {os.getcwd()}")
+    save_returns(data, data_instanteous, data_pct, output, path)
     return data, data_instanteous, data_pct
 
-def plot_performance(folder):
+
+def _write_excel(file, frames):
+    """
+    writes each frame to a sheet of file
+    with xlsxwriter installed rows are streamed to disk one at a time, so
+    memory stays flat however many securities there are
+    """
+    try:
+        import xlsxwriter
+    except ImportError:
+        with pd.ExcelWriter(file, datetime_format='yyyy-mm-dd') as writer:
+            for sheet, df in frames.items():
+                df.to_excel(writer, sheet_name=sheet)
+        return
+    with xlsxwriter.Workbook(file, {'constant_memory': True}) as workbook:
+        bold = workbook.add_format({'bold': True})
+        dates = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+        for sheet, df in frames.items():
+            worksheet = workbook.add_worksheet(sheet)
+            worksheet.write_row(0, 0, [df.index.name or '',
+                                       *map(str, df.columns)], bold)
+            # returns from a price of 0 are infinite, written as text like
+            # to_excel writes them
+            values = df.astype('object').where(df.notna(), None).replace(
+                {np.inf: 'inf', -np.inf: '-inf'}).to_numpy()
+            for row, (index, cells) in enumerate(zip(df.index, values), 1):
+                if isinstance(index, pd.Timestamp):
+                    worksheet.write_datetime(row, 0, index.to_pydatetime(),
+                                             dates)
+                else:
+                    worksheet.write(row, 0, index, bold)
+                worksheet.write_row(row, 1, cells.tolist())
+
+
+def save_returns(closes, returns, pct, output='xlsx', path='returns'):
+    """
+    saves closes, returns and pct change as sheets of {path}.xlsx
+    or, with output parquet or feather, as {path}-closes.parquet,
+    {path}-returns.parquet and {path}-pct_change.parquet
+    """
+    frames = dict(zip(RETURN_SHEETS, (closes, returns, pct)))
+    if output == 'xlsx':
+        file = f"{path}.xlsx"
+        _write_excel(file, frames)
+    else:
+        file = f"{path}-*.{output}"
+        for sheet, df in frames.items():
+            write_table(df, f"{path}-{sheet.replace(' ', '_')}.{output}")
+    print(f"Data retrieved and saved to {file} in {os.getcwd()}")
+
+
+def returns_to_excel(path='returns', fmt='parquet'):
+    """
+    writes {path}.xlsx on demand from returns saved as parquet or feather
+    """
+    frames = [read_table(f"{path}-{sheet.replace(' ', '_')}.{fmt}")
+              for sheet in RETURN_SHEETS]
+    save_returns(*frames, output='xlsx', path=path)
+
+def plot_performance(folder, workers=1, processes=False):
     """
     returns figure containing relative performance of all securities in folder
+    files are parsed on workers threads, or processes, before plotting;
+    a file that cannot be read leaves its plot empty
     """
-    files = [file for file in os.listdir(folder) if not file.startswith('0')]
+    plt = pyplot()
+    files = catalog(folder).files()
+    closes = read_tables([f"{folder}/{file}" for file in files], ['close'],
+                         workers, processes, errors='skip')
     fig, ax = plt.subplots(math.ceil(len(files)/ 4), 4, figsize=(16,16))
     count = 0
     for row in range(math.ceil(len(files)/ 4)):
         for column in range(4):
             try:
-                data = pd.read_csv(f"{folder}/{files[count]}")['close']
-                data = (data/data[0] -1) * 100
-                ax[row,column].plot(data, label= files[count][:-4])
+                data = closes[count]['close']
+                data = (data/data.iloc[0] -1) * 100
+                ax[row,column].plot(data.to_numpy(),
+                                    label= os.path.splitext(files[count])[0])
                 ax[row,column].legend()
-                ax[row,column].yaxis.set_major_formatter(mtick.PercentFormatter())
+                ax[row,column].yaxis.set_major_formatter(percent_formatter())
                 ax[row,column].axhline(0, c='r', ls='--')
             except:
                 pass
             count +=1
     plt.show()            
 
-def get_earnings(key):
+def get_earnings(key, cache=CACHE):
     """
     returns list of tickers for companies reporting in the next week
+    cache as for get_exchange_data
     """
-    client =EodHistoricalData(key)
-    eps = pd.DataFrame(client.get_calendar_earnings())
+    with EodClient(key, cache=cache) as client:
+        eps = pd.DataFrame(client.get("calendar/earnings"))
     symbols =[]
 
     for row in range(len(eps)):
@@ -210,39 +453,81 @@ def get_earnings(key):
     return symbols        
 
 
-def get_dividends(key, exchange ='US', date= dt.date.today()):
+def get_dividends(key, exchange ='US', date= dt.date.today(), cache=CACHE):
     """
     returns securities with specific ex-date
+    cache as for get_exchange_data
     """
-    client = EodHistoricalData(key)
-    data = pd.DataFrame(client.get_bulk_markets(exchange= exchange,
-                        date= date, type_='dividends'))
+    with EodClient(key, cache=cache) as client:
+        data = pd.DataFrame(client.get(f"eod-bulk-last-day/{exchange.upper()}",
+                            {'date': date, 'type': 'dividends'}))
     return data                    
 
 
-def screen_example(symbols, key):
+def screen_example(symbols, key, rate=None, cache=CACHE):
     """
     Returns DataFrame with current price, 52-week high and ratio 
     of high to current price. Symbols is list-like
+    cache as for get_exchange_data
     """
     high = {}
-    call = f"https://eodhistoricaldata.com/api/eod-bulk-last-day/US?api_token={key}&fmt=json"
-    data = pd.DataFrame(requests.get(call).json())
-    data.reset_index(drop=True)
+    results = Results()
+    with EodClient(key, cache=cache, rate=rate) as client:
+        data = pd.DataFrame(client.get("eod-bulk-last-day/US"))
+        data.reset_index(drop=True)
 
-    client = EodHistoricalData(key)
-    for ticker in symbols:
-        try:
-            high[ticker] = client.get_fundamental_equity(f"{ticker}.US")['Technicals']['52WeekHigh']
-            print(f"fetching {ticker}")
-        except:
-            print(f"{ticker} not available skipping")
+        for ticker in symbols:
+            try:
+                high[ticker] = client.get(f"fundamentals/{ticker}.US")['Technicals']['52WeekHigh']
+                print(f"fetching {ticker}")
+                results.add(ticker)
+            except (ApiError, KeyError, TypeError) as e:
+                print(f"{ticker} not available skipping")
+                results.add(ticker, e)
+    if results.failed:
+        results.summary()
 
     mask = data.code.isin(symbols)
     prices = data[['code', 'close']][mask]
     high = pd.Series(high, name='high')
     prices = prices.merge(high, right_on=high.index, left_on ='code')
     prices['ratio'] = prices['close'] / prices['high']
+    return prices
+
+
+def screen_local(symbols, folder='data_files', key=None, workers=1):
+    """
+    Returns DataFrame with current price, 52-week high and low and ratio
+    of high to current price, computed from the price files in folder.
+    Symbols without local files are fetched through screen_example when
+    key is given. Symbols is list-like
+    """
+    symbols = list(dict.fromkeys(symbols))
+    stored = catalog(folder)
+    files = [os.path.basename(stored.path(symbol))
+             for symbol in symbols if symbol in stored]
+    panels = _build_panels(folder, files, ['high', 'low', 'close'], workers)
+    if files:
+        panels = {column: panel.sort_index()
+                  for column, panel in panels.items()}
+        prices = pd.DataFrame({
+            'close': panels['close'].ffill().iloc[-1],
+            'high': panels['high'].rolling('365D').max().iloc[-1],
+            'low': panels['low'].rolling('365D').min().iloc[-1]})
+    else:
+        prices = pd.DataFrame(columns=['close', 'high', 'low'], dtype='float64')
+    prices = prices.reindex([s for s in symbols if s in prices.index])
+    prices = prices.rename_axis('code').reset_index()
+    prices['ratio'] = prices['close'] / prices['high']
+    prices['low_ratio'] = prices['close'] / prices['low']
+
+    missing = [s for s in symbols if s not in set(prices.code)]
+    if missing and key:
+        print(f"{len(missing)} symbols have no local history, fetching")
+        prices = pd.concat([prices, screen_example(missing, key)],
+                           ignore_index=True)
+    elif missing:
+        print(f"{len(missing)} symbols have no local history, skipping")
     return prices            
 
 
@@ -1,64 +1,123 @@
-from eod import EodHistoricalData
+from analyze.client import EodClient
+from analyze.plotting import percent_formatter, pyplot
+from analyze.storage import catalog, downcast, read_table, read_tables
+from analyze.trading_calendar import is_event
+from collections import deque
 import datetime as dt
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mtick
+import math
 import numpy as np
-import os
 import pandas as pd
-import seaborn as sb
-sb.set_theme()
 
 DEFAULT_DATE = dt.date.isoformat(dt.date.today() - dt.timedelta(396))
+# calc_vol columns, each computed from the columns it asks for
+DERIVED = {
+    'returns': lambda d: np.log(d['close']).diff().round(4),
+    'volatility': lambda d: d['returns'].rolling(21).std().round(4),
+    'change': lambda d: d['close'].diff(),
+    'hi_low_spread': lambda d: ((d['high'] - d['low']) / d['open']).round(2),
+    'exp_change': lambda d: (d['volatility'] * d['close'].shift(1)).round(2),
+    'magnitude': lambda d: (d['change'] / d['exp_change']).round(2),
+    'abs_magnitude': lambda d: np.abs(d['magnitude']),
+}
+VOL_COLUMNS = list(DERIVED)
+# decimals calc_vol rounds each column to; change is a difference of prices
+# in cents so it is compared in cents
+DECIMALS = {'returns': 4, 'volatility': 4, 'change': 2, 'hi_low_spread': 2,
+            'exp_change': 2, 'magnitude': 2, 'abs_magnitude': 2}
 
 
 class Stock:
-    def __init__(self, symbol, key, date =DEFAULT_DATE, folder=None):
+    def __init__(self, symbol, key, date =DEFAULT_DATE, folder=None, data=None,
+                 compact=False):
         self.symbol = symbol
         self.key = key
         self.date = date
         self.folder = folder
-        self.data = self.get_data()
+        self.compact = compact
+        self.data = self.get_data() if data is None else data
+        self.rolling = None
 
 
     def get_data(self):
-        available_data = [filename[:-4] 
-        for filename in os.listdir(self.folder) if not filename.startswith('0')]
-        if self.symbol in available_data:
-            data = pd.read_csv(f"{self.folder}/{self.symbol}.csv", 
-                                index_col='date').round(2)
-            data.index = pd.DatetimeIndex(data.index)                    
+        path = catalog(self.folder or '.').path(self.symbol)
+        if path:
+            data = read_table(path).round(2)
         else:
-            client = EodHistoricalData(self.key)
-            data = pd.DataFrame(client.get_prices_eod(self.symbol,
-                                from_=self.date)).round(2)
+            with EodClient(self.key) as client:
+                data = pd.DataFrame(client.get(f"eod/{self.symbol}",
+                                               {'from': self.date},
+                                               cache=False)).round(2)
             data.index = pd.DatetimeIndex(data.date)
             data.drop(columns=['date'], inplace = True)
-            self.calc_vol(data)
-        return data
+        return downcast(data) if self.compact else data
+
+    def column(self, name):
+        """
+        returns a column of data; calc_vol columns are computed the first
+        time they, or a column depending on them, are asked for and kept in
+        data, so each is computed at most once
+        """
+        return _Derived(self.data).get(name)
 
     def calc_vol(self, df):
-        df['returns'] = np.log(df.close).diff().round(4)
-        df['volatility'] = df.returns.rolling(21).std().round(4)
-        df['change'] = df['close'].diff()
-        df['hi_low_spread'] = ((df['high'] -df['low']) / df['open']).round(2)
-        df['exp_change'] = (df.volatility * df.close.shift(1)).round(2)
-        df['magnitude'] = (df.change / df.exp_change).round(2)
-        df['abs_magnitude'] = np.abs(df.magnitude)
+        for column, values in _vol_columns(df.open, df.high, df.low,
+                                           df.close).items():
+            df[column] = values
         df.dropna(inplace= True)
 
+    def update(self, bar):
+        """
+        appends a new daily bar with its calc_vol columns
+        only the latest volatility window is updated, not the whole history
+        bar is a dict with date, open, high, low and close, like the api returns
+        """
+        if self.rolling is None:
+            self.rolling = RollingVol(self.data.close)
+        # computed over the history once, so the new row has columns to go in
+        missing = [column for column in VOL_COLUMNS
+                   if column not in self.data]
+        if missing:
+            derived = _Derived(self.data)
+            for column in missing:
+                derived.get(column)
+        bar = dict(bar)
+        date = pd.Timestamp(bar.pop('date'))
+        row = {column: round(value, 2) if isinstance(value, (int, float))
+               else value for column, value in bar.items()}
+        row.update(self.rolling.update(row['open'], row['high'], row['low'],
+                                       row['close']))
+        self.data = pd.concat([self.data, self._row_frame(date, row)])
+        return row
+
+    def _row_frame(self, date, row):
+        """
+        returns row as a one row frame in the dtypes of data, so appending
+        it upcasts nothing, compact or not; integer columns the row has no
+        value for are left to widen
+        """
+        new = pd.DataFrame([row], index=pd.DatetimeIndex(
+            [date], name=self.data.index.name)).reindex(
+            columns=self.data.columns)
+        return new.astype({column: dtype for column, dtype
+                           in self.data.dtypes.items()
+                           if new[column].notna().all()
+                           or not pd.api.types.is_integer_dtype(dtype)})
+
     def plot_return_dist(self):
+        plt = pyplot(theme=True)
         start = self.data.index[0]
         end  = self.data.index[-1]
-        plt.hist(self.data['returns'], bins=20, edgecolor='w')
+        plt.hist(self.column('returns').dropna(), bins=20, edgecolor='w')
         plt.suptitle(f"Distribution of returns for {self.symbol}", fontsize=14)
         plt.title(f"From {start} to {end}", fontsize=12)
         plt.show()
 
 
     def plot_volatility(self):
+        plt = pyplot(theme=True)
         start = self.data.index[0]
         end  = self.data.index[-1]
-        plt.scatter(self.data['returns'], self.data['abs_magnitude'])
+        plt.scatter(self.column('returns'), self.column('abs_magnitude'))
         plt.axhline(0, c='r', ls='--')
         plt.axvline(0, c='r', ls='--')
         plt.suptitle(f"Volatility of returns for {self.symbol}", fontsize=14)
@@ -66,40 +125,351 @@ class Stock:
         plt.show()
 
     def plot_performance(self):
+        plt = pyplot(theme=True)
         start = self.data.index[0]
         end  = self.data.index[-1]
-        plt.plot((self.data.close / self.data.close[0] - 1) * 100)
+        plt.plot((self.data.close / self.data.close.iloc[0] - 1) * 100)
         plt.axhline(0, c='r', ls='--')
         plt.suptitle(f"Volatility of returns for {self.symbol}", fontsize=14)
         plt.title(f"From {start} to {end}", fontsize=12)
-        plt.gca().yaxis.set_major_formatter(mtick.PercentFormatter())
+        plt.gca().yaxis.set_major_formatter(percent_formatter())
         plt.show()
 
 
 
-    def option_expiry(self):
-        mask = np.where((self.data.index.day > 14) &
-                        (self.data.index.day < 22) &
-                        (self.data.index.dayofweek == 4), True, False)
-        return self.data[mask]
+    def option_expiry(self, weekly=False):
+        """
+        returns rows on monthly option expiries, or weekly ones with weekly;
+        an expiry on a holiday moves to the session before it
+        """
+        event = 'weekly_expiry' if weekly else 'monthly_expiry'
+        return self.data[is_event(self.data.index, event)]
 
 
 
     def low_vol_duration(self):
-        pd.set_option('mode.chained_assignment', None)
-        self.data['days<2sd'] = 0
-        count = 0
-        for row in range(len(self.data)):
-            if self.data['magnitude'].iloc[row] < 2:
-                count += 1
-                self.data['days<2sd'].iloc[row] = count
-            else:
-                self.data['days<2sd'].iloc[row] = count
-                count = 0
-        low_vol = self.data[self.data.magnitude >= 2]
+        magnitude = self.column('magnitude')
+        self.data['days<2sd'] = low_vol_days(magnitude)
+        low_vol = self.data[magnitude >= 2]
         return low_vol        
                   
 
+def low_vol_days(magnitude):
+    """
+    returns running count of days with magnitude below 2
+    a day at or above 2 keeps the count so far and resets it for the next day
+    magnitude is a Series or a wide panel with one column per symbol
+    """
+    below = np.asarray(magnitude) < 2
+    count = np.cumsum(below, axis=0)
+    resets = np.maximum.accumulate(np.where(below, 0, count), axis=0)
+    days = count - np.concatenate([np.zeros_like(resets[:1]), resets[:-1]])
+    if isinstance(magnitude, pd.DataFrame):
+        return pd.DataFrame(days, index=magnitude.index,
+                            columns=magnitude.columns)
+    return pd.Series(days, index=magnitude.index, name='days<2sd')
+
+
+class RollingVol:
+    """
+    running calc_vol state over the latest window of returns
+    each update adds one return and drops the oldest, so it costs O(1)
+    """
+    def __init__(self, closes, window=21):
+        self.window = window
+        self.returns = deque()
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.close = None
+        for close in list(closes)[-(window + 1):]:
+            self._add_close(close)
+
+    def _add_close(self, close):
+        value = np.nan
+        if self.close is not None:
+            if len(self.returns) == self.window:
+                self._remove(self.returns.popleft())
+            value = round(math.log(close / self.close), 4)
+            self.returns.append(value)
+            self._add(value)
+        self.close = close
+        return value
+
+    def _add(self, value):
+        n = len(self.returns)
+        delta = value - self.mean
+        self.mean += delta / n
+        self.m2 += delta * (value - self.mean)
+
+    def _remove(self, value):
+        n = len(self.returns)
+        delta = value - self.mean
+        self.mean -= delta / n
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    @property
+    def volatility(self):
+        if len(self.returns) < self.window:
+            return np.nan
+        return round(math.sqrt(self.m2 / (self.window - 1)), 4)
+
+    def update(self, open_, high, low, close):
+        """
+        returns calc_vol columns for a new bar and moves the window on
+        """
+        previous = np.nan if self.close is None else self.close
+        returns = self._add_close(close)
+        volatility = self.volatility
+        change = close - previous
+        exp_change = round(volatility * previous, 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            magnitude = round(np.float64(change) / exp_change, 2)
+        return {'returns': returns,
+                'volatility': volatility,
+                'change': change,
+                'hi_low_spread': round((high - low) / open_, 2),
+                'exp_change': exp_change,
+                'magnitude': magnitude,
+                'abs_magnitude': abs(magnitude)}
+
+
+class _Derived:
+    """
+    columns by name, computing DERIVED ones and their inputs on first use
+    and storing them back into columns, a DataFrame or a dict of panels
+    formulas always see float64 values; results are stored as float32 when
+    the closes are, so compact prices get compact calc_vol columns
+    """
+    def __init__(self, columns):
+        self.columns = columns
+        self.dtype = _float_dtype(columns['close'])
+        self.exact = {}
+
+    def __getitem__(self, name):
+        if name not in self.exact:
+            if name in self.columns:
+                values = self.columns[name].astype('float64')
+            else:
+                values = DERIVED[name](self)
+                self.columns[name] = values.astype(self.dtype)
+            self.exact[name] = values
+        return self.exact[name]
+
+    def get(self, name):
+        """
+        returns column as stored, computing it first if it is DERIVED
+        """
+        if name not in self.columns:
+            self[name]
+        return self.columns[name]
+
+
+def _float_dtype(values):
+    """
+    returns float32 for compact prices, Series or wide panel, else float64
+    """
+    dtypes = values.dtypes if isinstance(values, pd.DataFrame) else [
+        values.dtype]
+    return ('float32' if len(dtypes) and all(dtype == 'float32'
+                                             for dtype in dtypes)
+            else 'float64')
+
+
+def _vol_columns(open_, high, low, close):
+    """
+    returns calc_vol columns from price Series or wide panels alike
+    """
+    columns = _Derived({'open': open_, 'high': high, 'low': low,
+                        'close': close})
+    return {name: columns.get(name) for name in VOL_COLUMNS}
+
+
+def compact_accuracy(data):
+    """
+    returns how far calc_vol columns from compact prices are from float64
+    data holds open, high, low and close, e.g. Stock.data; for each column
+    max_error is the largest absolute difference and differ the share of
+    values that differ once rounded as calc_vol rounds them, i.e. where the
+    float32 prices moved the last digit; volume, when data has it, is
+    checked as downcast stores it
+    """
+    prices = [data[column] for column in ['open', 'high', 'low', 'close']]
+    exact = _vol_columns(*(values.astype('float64') for values in prices))
+    compact = _vol_columns(*(values.astype('float32') for values in prices))
+    rows = {}
+    for name in VOL_COLUMNS:
+        a = exact[name]
+        b = compact[name].astype('float64')
+        both = a.notna() & b.notna()
+        a, b = a.round(DECIMALS[name]), b.round(DECIMALS[name])
+        differ = (a != b) & (a.notna() | b.notna())
+        rows[name] = {'max_error': (a - b)[both].abs().max(),
+                      'differ': differ.mean() if len(differ) else 0.0}
+    if 'volume' in data:
+        volume = data['volume'].astype('float64')
+        error = (downcast(data[['volume']])['volume'].astype('float64')
+                 - volume).abs()
+        rows['volume'] = {'max_error': error.max(),
+                          'differ': (error > 0).mean() if len(error) else 0.0}
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def _masked_vol_columns(opens, highs, lows, closes):
+    """
+    returns calc_vol columns of wide panels, empty wherever any of them is,
+    and the mask of values kept
+    each symbol's columns are computed over its own dates only, the dates
+    it has all four prices, so a date missing for one symbol does not cost
+    it a volatility window; the panels are sorted so each symbol's dates
+    come first, computed at once and put back in place
+    """
+    prices = [opens, highs, lows, closes]
+    present = ~np.logical_or.reduce([panel.isna().to_numpy()
+                                     for panel in prices])
+    order = np.argsort(~present, axis=0, kind='stable')
+    packed = _vol_columns(*(pd.DataFrame(
+        np.take_along_axis(panel.to_numpy(), order, axis=0),
+        columns=panel.columns) for panel in prices))
+    columns = {}
+    for column, values in packed.items():
+        unpacked = np.empty(values.shape, dtype=values.to_numpy().dtype)
+        np.put_along_axis(unpacked, order, values.to_numpy(), axis=0)
+        columns[column] = pd.DataFrame(unpacked, index=closes.index,
+                                       columns=closes.columns)
+    valid = present & ~np.logical_or.reduce([values.isna().to_numpy()
+                                             for values in columns.values()])
+    return ({column: values.where(valid)
+             for column, values in columns.items()}, valid)
+
+
+def calc_vol_panel(opens, highs, lows, closes, as_dict=False):
+    """
+    returns calc_vol columns for every symbol of wide price panels at once
+    panels share dates as index and symbols as columns, e.g. from
+    get_closing_prices; each symbol's values are those Stock.calc_vol gives
+    from its own dates, dates it lacks are left empty
+    returns a frame with (column, symbol) MultiIndex or a dict of wide frames
+    """
+    columns, valid = _masked_vol_columns(opens, highs, lows, closes)
+    rows = valid.any(axis=1)
+    columns = {column: values[rows] for column, values in columns.items()}
+    if as_dict:
+        return columns
+    return pd.concat(columns, axis=1)
+
+
+class StockUniverse:
+    """
+    price data for many symbols loaded once into one contiguous block
+    values has shape symbols x dates x columns, so each symbol's rows are
+    one contiguous slice; stock(symbol) returns a Stock over the dates the
+    symbol has data for and panel(column) a dates x symbols view; a symbol
+    with data on every date of its span gets a view of its slice, one that
+    lacks dates other symbols have gets a copy of just its own rows
+    with derived the calc_vol columns are computed for every symbol at
+    once, each over its own dates, and stored in the block as well
+    compact stores the block as float32, half the memory of float64
+    volume is kept apart in an integer array, symbols x dates, as uint32
+    with compact when it fits, since float32 is exact only up to 2**24
+    """
+    PRICES = ['open', 'high', 'low', 'close', 'adjusted_close', 'volume']
+    FLOATS = PRICES[:-1]
+
+    def __init__(self, symbols=None, folder='data_files', key=None,
+                 derived=True, workers=1, compact=False):
+        self.folder = folder
+        self.key = key
+        self.compact = compact
+        dtype = 'float32' if compact else 'float64'
+        stored = catalog(folder)
+        symbols = stored.symbols() if symbols is None else [
+            symbol for symbol in dict.fromkeys(symbols) if symbol in stored]
+        frames = read_tables([stored.path(symbol) for symbol in symbols],
+                             workers=workers)
+        self.symbols = pd.Index(symbols)
+        self.dates = pd.DatetimeIndex(np.unique(np.concatenate(
+            [df.index.to_numpy() for df in frames] or [[]])).astype(
+            'datetime64[ns]'), name='date')
+        self.columns = list(self.FLOATS) + (list(VOL_COLUMNS) if derived
+                                            else [])
+        self.values = np.full((len(symbols), len(self.dates),
+                               len(self.columns)), np.nan, dtype=dtype)
+        volume = np.zeros((len(symbols), len(self.dates)), dtype='int64')
+        for i, df in enumerate(frames):
+            rows = self.dates.get_indexer(df.index)
+            prices = df.reindex(columns=self.FLOATS).round(2)
+            self.values[i, rows, :len(self.FLOATS)] = prices.to_numpy(
+                dtype=dtype)
+            if 'volume' in df:
+                volume[i, rows] = df['volume'].fillna(0).to_numpy()
+        if compact and (not volume.size
+                        or 0 <= volume.min() and volume.max() < 2**32):
+            volume = volume.astype('uint32')
+        self.volume = volume
+        if derived and len(symbols):
+            columns, _ = _masked_vol_columns(*(self.panel(column) for column
+                                               in ['open', 'high', 'low',
+                                                   'close']))
+            for column, values in columns.items():
+                self.values[:, :, self.columns.index(column)] = \
+                    values.to_numpy().T
+        self._rows = {}
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __iter__(self):
+        return (self.stock(symbol) for symbol in self.symbols)
+
+    def __getitem__(self, symbol):
+        return self.stock(symbol)
+
+    def panel(self, column):
+        """
+        returns dates x symbols frame of one column, a view of the block
+        volume is the exception, a float64 copy empty where a symbol has no bar
+        """
+        if column == 'volume':
+            return pd.DataFrame(self.volume.T, index=self.dates,
+                                columns=self.symbols, dtype='float64').where(
+                self.panel('close').notna())
+        values = self.values[:, :, self.columns.index(column)].T
+        return pd.DataFrame(values, index=self.dates, columns=self.symbols,
+                            copy=False)
+
+    def _rows_of(self, i):
+        """
+        returns the rows where the symbol has data in all columns, the rows
+        Stock.get_data and calc_vol would keep, as a slice when they are
+        contiguous and an index array otherwise
+        """
+        if i not in self._rows:
+            rows = np.flatnonzero(~np.isnan(self.values[i]).any(axis=1))
+            if not len(rows):
+                rows = slice(0, 0)
+            elif rows[-1] - rows[0] + 1 == len(rows):
+                rows = slice(rows[0], rows[-1] + 1)
+            self._rows[i] = rows
+        return self._rows[i]
+
+    def frame(self, symbol):
+        """
+        returns the symbol's rows as a frame, a view of the block when they
+        are contiguous
+        """
+        i = self.symbols.get_loc(symbol)
+        rows = self._rows_of(i)
+        df = pd.DataFrame(self.values[i, rows], index=self.dates[rows],
+                          columns=self.columns, copy=False)
+        df.insert(len(self.FLOATS), 'volume', self.volume[i, rows])
+        return df
+
+    def stock(self, symbol):
+        """
+        returns Stock over the symbol's rows without loading anything
+        """
+        return Stock(symbol, self.key, folder=self.folder,
+                     data=self.frame(symbol), compact=self.compact)
 
 
 def main():
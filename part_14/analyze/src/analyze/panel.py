@@ -0,0 +1,54 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from analyze.storage import read_table
+
+
+def _sidecar(path):
+    return f"{os.path.splitext(path)[0]}.json"
+
+
+def save_panel(df, path):
+    """
+    stores wide date by symbol frame as a float64 .npy array, or float32
+    when every column already is, as in compact mode
+    dates and symbols go to a json sidecar next to it
+    """
+    dtype = ('float32' if len(df.columns) and (df.dtypes == 'float32').all()
+             else 'float64')
+    values = np.ascontiguousarray(df.to_numpy(dtype=dtype))
+    temp = f"{path}.tmp"
+    with open(temp, 'wb') as f:
+        np.save(f, values)
+    os.replace(temp, path)
+    index = {'dates': [d.strftime('%Y-%m-%d') for d in df.index],
+             'symbols': [str(column) for column in df.columns]}
+    with open(f"{temp}.json", 'w') as f:
+        json.dump(index, f)
+    os.replace(f"{temp}.json", _sidecar(path))
+
+
+def load_panel(path, mmap=True):
+    """
+    returns wide date by symbol frame from a .npy panel
+    with mmap the frame reads straight from the memory mapped file, so
+    processes opening the same panel share one copy and nothing is parsed
+    """
+    values = np.load(path, mmap_mode='r' if mmap else None)
+    with open(_sidecar(path)) as f:
+        index = json.load(f)
+    if values.shape != (len(index['dates']), len(index['symbols'])):
+        raise ValueError(f"{path} does not match its index {_sidecar(path)}")
+    return pd.DataFrame(values,
+                        index=pd.DatetimeIndex(index['dates'], name='date'),
+                        columns=index['symbols'], copy=False)
+
+
+def read_panel(path, mmap=True):
+    """
+    returns wide frame from a .npy panel or a csv, parquet or feather file
+    """
+    if path.endswith('.npy'):
+        return load_panel(path, mmap)
+    return read_table(path)
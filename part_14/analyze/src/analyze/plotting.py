@@ -0,0 +1,35 @@
+import os
+
+_themed = False
+
+
+def headless():
+    """
+    makes matplotlib render off screen, must run before pyplot is imported
+    """
+    os.environ['MPLBACKEND'] = 'Agg'
+
+
+def pyplot(theme=False):
+    """
+    returns matplotlib.pyplot, imported on first use rather than with the
+    package; theme applies the seaborn theme once, if seaborn is installed
+    """
+    global _themed
+    import matplotlib.pyplot as plt
+    if theme and not _themed:
+        try:
+            import seaborn as sb
+            sb.set_theme()
+        except ImportError:
+            pass
+        _themed = True
+    return plt
+
+
+def percent_formatter():
+    """
+    returns matplotlib formatter showing values as percentages
+    """
+    import matplotlib.ticker as mtick
+    return mtick.PercentFormatter()
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+
+def _filled(values):
+    """
+    returns values with gaps in each column filled by its last price
+    """
+    valid = ~np.isnan(values)
+    rows = np.where(valid, np.arange(len(values))[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    filled = np.take_along_axis(values, rows, axis=0)
+    filled[np.cumsum(valid, axis=0) == 0] = np.nan
+    return filled
+
+
+def panel_returns(prices, kinds=('log', 'simple'), horizons=(1,),
+                  missing='nan'):
+    """
+    returns dict of wide return frames keyed by (kind, horizon)
+    kinds are log and simple returns, horizons are in rows, so (1, 5, 21)
+    gives daily, weekly and monthly returns; prices may be a memory
+    mapped panel, log prices are taken once for every horizon
+    missing='nan' leaves a return empty when either price is missing,
+    missing='skip' measures from the last price the column has instead;
+    no rows are dropped, each column keeps its own gaps
+    """
+    values = np.asarray(prices, dtype='float64')
+    if missing == 'skip':
+        gaps = np.isnan(values)
+        values = _filled(values)
+    elif missing != 'nan':
+        raise ValueError("missing must be 'nan' or 'skip'")
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_prices = np.log(values) if 'log' in kinds else None
+        results = {}
+        for horizon in horizons:
+            for kind in kinds:
+                result = np.full(values.shape, np.nan)
+                if kind == 'log':
+                    np.subtract(log_prices[horizon:], log_prices[:-horizon],
+                                out=result[horizon:])
+                elif kind == 'simple':
+                    np.divide(values[horizon:], values[:-horizon],
+                              out=result[horizon:])
+                    result[horizon:] -= 1
+                else:
+                    raise ValueError("kinds are 'log' or 'simple'")
+                if missing == 'skip':
+                    result[gaps] = np.nan
+                results[kind, horizon] = pd.DataFrame(
+                    result, index=prices.index, columns=prices.columns,
+                    copy=False)
+    return results
+
+
+def log_returns(prices, horizon=1, missing='nan'):
+    """
+    returns wide frame of log returns, dropping only rows with none at all
+    """
+    returns = panel_returns(prices, ('log',), (horizon,), missing)
+    return returns['log', horizon].dropna(how='all')
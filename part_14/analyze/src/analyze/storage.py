@@ -0,0 +1,324 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+import os
+import shutil
+import threading
+import pandas as pd
+
+FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.feather': 'feather'}
+COMPRESSION = {'parquet': 'snappy', 'feather': 'lz4'}
+
+
+def file_format(path):
+    """
+    returns storage format of a price file from its extension
+    """
+    ext = os.path.splitext(path)[1]
+    if ext not in FORMATS:
+        raise ValueError(f"{path} is not a csv, parquet or feather file")
+    return FORMATS[ext]
+
+
+def price_file(folder, symbol, fmt='csv'):
+    """
+    returns path of the price file for symbol in the given format
+    """
+    return f"{folder}/{symbol}.{fmt}"
+
+
+def price_files(folder):
+    """
+    returns per-ticker price files in folder
+    files starting with 0 hold combined panels and are left out
+    """
+    return [file for file in os.listdir(folder)
+            if os.path.splitext(file)[1] in FORMATS
+            and not file.startswith('0')]
+
+
+class Catalog:
+    """
+    index of the price files in a folder by symbol
+    the folder is listed again only when its mtime changes, which adding,
+    removing or replacing a file does; path lookups are then dict lookups
+    last date and row count of a file are read when first asked for and
+    kept until the file's mtime changes
+    a symbol stored in more than one format maps to its newest file, so
+    the copy an update last wrote is the one read
+    """
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+        self.lock = threading.Lock()
+        self._mtime = None
+        self._paths = {}
+        self._info = {}
+
+    def refresh(self, force=False):
+        """
+        lists the folder again if it changed since the last listing
+        """
+        with self.lock:
+            try:
+                mtime = os.stat(self.folder).st_mtime_ns
+            except FileNotFoundError:
+                # nothing stored yet, the folder is made by the first download
+                mtime = None
+            if force or mtime != self._mtime:
+                paths = {}
+                for file in price_files(self.folder) if mtime else []:
+                    symbol = os.path.splitext(file)[0]
+                    path = f"{self.folder}/{file}"
+                    if symbol not in paths or _preferred(path, paths[symbol]):
+                        paths[symbol] = path
+                self._paths = paths
+                self._mtime = mtime
+
+    def path(self, symbol):
+        """
+        returns path of stored prices for symbol, None if absent
+        """
+        self.refresh()
+        return self._paths.get(symbol)
+
+    def __contains__(self, symbol):
+        return self.path(symbol) is not None
+
+    def symbols(self):
+        """
+        returns symbols with stored prices in folder listing order
+        """
+        self.refresh()
+        return list(self._paths)
+
+    def files(self):
+        """
+        returns file names of stored prices in folder listing order
+        """
+        self.refresh()
+        return [os.path.basename(path) for path in self._paths.values()]
+
+    def info(self, symbol):
+        """
+        returns dict with path, last_date, rows and mtime for symbol
+        """
+        path = self.path(symbol)
+        if path is None:
+            return None
+        mtime = os.stat(path).st_mtime_ns
+        info = self._info.get(path)
+        if info is None or info['mtime'] != mtime:
+            info = {'path': path, 'last_date': last_date(path),
+                    'rows': _count_rows(path), 'mtime': mtime}
+            self._info[path] = info
+        return info
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def catalog(folder):
+    """
+    returns the Catalog shared by everything reading prices from folder
+    """
+    key = os.path.abspath(folder)
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = Catalog(folder)
+        return _catalogs[key]
+
+
+def _preferred(path, current):
+    """
+    tells if path wins over current for the same symbol: the newer file
+    wins, a binary one over csv when both were written at once
+    """
+    order = list(FORMATS)
+    return ((os.stat(path).st_mtime_ns, order.index(os.path.splitext(path)[1]))
+            > (os.stat(current).st_mtime_ns,
+               order.index(os.path.splitext(current)[1])))
+
+
+def _count_rows(path):
+    if file_format(path) != 'csv':
+        return len(read_table(path, columns=[]))
+    with open(path, 'rb') as f:
+        lines = sum(chunk.count(b'\n')
+                    for chunk in iter(lambda: f.read(1 << 20), b''))
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            lines += 1
+    return max(lines - 1, 0)
+
+
+def downcast(df):
+    """
+    returns df in compact dtypes, about half the memory of the defaults
+    float columns become float32, which keeps about 7 significant digits,
+    plenty for prices in cents; volume becomes uint32, or int32, unless it
+    has gaps or does not fit in 32 bits; text columns become categorical
+    """
+    dtypes = {}
+    for column, values in df.items():
+        if column == 'volume':
+            dtypes[column] = _volume_dtype(values)
+        elif pd.api.types.is_float_dtype(values):
+            dtypes[column] = 'float32'
+        elif (pd.api.types.is_object_dtype(values)
+              or pd.api.types.is_string_dtype(values)):
+            dtypes[column] = 'category'
+    return df.astype({column: dtype for column, dtype in dtypes.items()
+                      if dtype is not None})
+
+
+def _volume_dtype(volume):
+    if not pd.api.types.is_numeric_dtype(volume) or volume.isna().any():
+        return None
+    if len(volume) and (volume % 1).any():
+        return None
+    low, high = (volume.min(), volume.max()) if len(volume) else (0, 0)
+    if 0 <= low and high < 2**32:
+        return 'uint32'
+    if -2**31 <= low and high < 2**31:
+        return 'int32'
+    return None
+
+
+def read_table(path, columns=None, compact=False):
+    """
+    returns date indexed DataFrame from a csv, parquet or feather file
+    columns limits which columns are parsed, compact downcasts the result
+    """
+    fmt = file_format(path)
+    if fmt == 'csv':
+        usecols = None if columns is None else ['date', *columns]
+        df = pd.read_csv(path, usecols=usecols, index_col='date',
+                         parse_dates=['date'])
+    elif fmt == 'parquet':
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        columns = None if columns is None else ['date', *columns]
+        df = pd.read_feather(path, columns=columns).set_index('date')
+    return downcast(df) if compact else df
+
+
+def _read_or_none(path, columns=None, compact=False):
+    """
+    returns read_table of path, None if the file cannot be read
+    """
+    try:
+        return read_table(path, columns, compact)
+    except Exception:
+        return None
+
+
+def read_tables(paths, columns=None, workers=1, processes=False,
+                chunksize=None, compact=False, errors='raise'):
+    """
+    returns list of date indexed frames in the same order as paths
+    files are parsed on workers threads, or worker processes with processes,
+    which take chunksize files at a time; workers=None uses every core
+    errors='skip' puts None in place of a file that cannot be read, say a
+    malformed one or one without the columns, instead of raising
+    """
+    if errors not in ('raise', 'skip'):
+        raise ValueError("errors must be 'raise' or 'skip'")
+    read = read_table if errors == 'raise' else _read_or_none
+    paths = list(paths)
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(paths) < 2:
+        return [read(path, columns, compact) for path in paths]
+    if not processes:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(read, paths, repeat(columns),
+                                 repeat(compact)))
+    chunksize = chunksize or max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(read, paths, repeat(columns),
+                             repeat(compact), chunksize=chunksize))
+
+
+def _write(df, path, fmt, compression):
+    if fmt == 'csv':
+        df.to_csv(path)
+    elif fmt == 'parquet':
+        df.to_parquet(path, compression=compression or COMPRESSION[fmt])
+    else:
+        df.reset_index().to_feather(path,
+                                    compression=compression or COMPRESSION[fmt])
+
+
+def write_table(df, path, compression=None, compact=False):
+    """
+    stores date indexed DataFrame in the format given by the extension of path
+    the file is replaced in one step so readers never see a partial write
+    compact writes the frame in downcast dtypes
+    """
+    df = df.rename_axis('date')
+    if compact:
+        df = downcast(df)
+    temp = f"{path}.tmp"
+    _write(df, temp, file_format(path), compression)
+    os.replace(temp, path)
+
+
+def last_date(path):
+    """
+    returns last date in a stored price file, None if it holds no bars
+    """
+    if file_format(path) != 'csv':
+        dates = read_table(path, columns=[]).index
+        return dates.max() if len(dates) else None
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 4096, 0))
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    if not lines or lines[-1].startswith(b'date'):
+        return None
+    return pd.Timestamp(lines[-1].split(b',')[0].decode())
+
+
+def append_table(df, path, compact=False):
+    """
+    appends rows dated after the last stored date to an existing price file
+    compact keeps a parquet or feather file in downcast dtypes
+    returns number of rows appended
+    """
+    last = last_date(path)
+    if last is not None:
+        df = df[df.index > last]
+    if df.empty:
+        return 0
+    if file_format(path) == 'csv':
+        with open(path) as f:
+            columns = f.readline().strip().split(',')[1:]
+        temp = f"{path}.tmp"
+        shutil.copyfile(path, temp)
+        with open(temp, 'a', newline='') as f:
+            df.reindex(columns=columns).to_csv(f, header=False)
+        os.replace(temp, path)
+    else:
+        stored = read_table(path)
+        write_table(pd.concat([stored, df.reindex(columns=stored.columns)]),
+                    path, compact=compact)
+    return len(df)
+
+
+def convert_folder(folder, fmt='parquet', remove=False, compact=False):
+    """
+    rewrites every csv, parquet or feather file in folder into fmt
+    use fmt='csv' to export binary files back to csv
+    remove deletes the originals once converted, compact downcasts them
+    """
+    converted = 0
+    for file in os.listdir(folder):
+        name, ext = os.path.splitext(file)
+        if ext not in FORMATS or FORMATS[ext] == fmt:
+            continue
+        write_table(read_table(f"{folder}/{file}"), f"{folder}/{name}.{fmt}",
+                    compact=compact)
+        if remove:
+            os.remove(f"{folder}/{file}")
+        converted += 1
+    print(f"{converted} files converted to {fmt} in {folder}")
+    return converted
@@ -0,0 +1,187 @@
+import datetime as dt
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+FIRST_YEAR = 1990
+LAST_YEAR = dt.date.today().year + 1
+EVENTS = ('session', 'holiday', 'monthly_expiry', 'weekly_expiry',
+          'quarter_end', 'rebalance')
+# NYSE closings outside the regular holiday rules
+SPECIAL_CLOSINGS = ['1994-04-27', '2001-09-11', '2001-09-12', '2001-09-13',
+                    '2001-09-14', '2004-06-11', '2007-01-02', '2012-10-29',
+                    '2012-10-30', '2018-12-05', '2025-01-09']
+
+
+def _easter(year):
+    """
+    returns Easter Sunday of year in the Gregorian calendar
+    """
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    g = (b - (b + 8) // 25 + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return dt.date(year, month, day + 1)
+
+
+def _weekday(year, month, weekday, n):
+    """
+    returns the nth weekday, Monday being 0, of a month; n=-1 is the last
+    """
+    if n > 0:
+        first = dt.date(year, month, 1)
+        return first + dt.timedelta((weekday - first.weekday()) % 7
+                                    + 7 * (n - 1))
+    last = dt.date(year + month // 12, month % 12 + 1, 1) - dt.timedelta(1)
+    return last - dt.timedelta((last.weekday() - weekday) % 7 + 7 * (-n - 1))
+
+
+def _observed(day):
+    """
+    returns the day a holiday is observed: Friday for a Saturday, Monday
+    for a Sunday
+    """
+    if day.weekday() == 5:
+        return day - dt.timedelta(1)
+    if day.weekday() == 6:
+        return day + dt.timedelta(1)
+    return day
+
+
+def _holidays(year):
+    """
+    returns NYSE holidays of year by the current rules
+    """
+    days = [_weekday(year, 2, 0, 3),
+            _easter(year) - dt.timedelta(2),
+            _weekday(year, 5, 0, -1),
+            _observed(dt.date(year, 7, 4)),
+            _weekday(year, 9, 0, 1),
+            _weekday(year, 11, 3, 4),
+            _observed(dt.date(year, 12, 25))]
+    new_year = dt.date(year, 1, 1)
+    # a Saturday New Year's Day closes no Friday, that would end the year
+    if new_year.weekday() != 5:
+        days.append(_observed(new_year))
+    if year >= 1998:
+        days.append(_weekday(year, 1, 0, 3))
+    if year >= 2022:
+        days.append(_observed(dt.date(year, 6, 19)))
+    return days
+
+
+def _on_or_before(sessions, days):
+    """
+    returns the last session on or before each of days
+    """
+    rows = np.searchsorted(sessions, days, side='right') - 1
+    return sessions[rows[rows >= 0]]
+
+
+@lru_cache(maxsize=8)
+def _table(first_year, last_year):
+    """
+    returns dict of read only sorted day ordinals, one array per event
+    expiries falling on a holiday move to the session before, as do quarter
+    ends; index rebalances take effect after the March, June, September and
+    December monthly expiries
+    """
+    holidays = [day for year in range(first_year, last_year + 1)
+                for day in _holidays(year)]
+    holidays = np.unique(np.concatenate([
+        np.array(holidays, dtype='datetime64[D]'),
+        np.array(SPECIAL_CLOSINGS, dtype='datetime64[D]')]).astype('int64'))
+    days = np.arange(np.datetime64(f"{first_year}-01-01"),
+                     np.datetime64(f"{last_year + 1}-01-01")).astype('int64')
+    # day 0, 1970-01-01, was a Thursday
+    weekday = (days + 3) % 7
+    holidays = holidays[(holidays >= days[0]) & (holidays <= days[-1])]
+    sessions = days[(weekday < 5) & ~np.isin(days, holidays)]
+
+    months = np.arange(np.datetime64(f"{first_year}-01"),
+                       np.datetime64(f"{last_year + 1}-01"))
+    firsts = months.astype('datetime64[D]').astype('int64')
+    third_fridays = firsts + (4 - (firsts + 3) % 7) % 7 + 14
+    month_ends = (months + 1).astype('datetime64[D]').astype('int64') - 1
+    quarterly = months.astype('int64') % 3 == 2
+
+    table = {'session': sessions,
+             'holiday': holidays,
+             'monthly_expiry': _on_or_before(sessions, third_fridays),
+             'weekly_expiry': _on_or_before(sessions, days[weekday == 4]),
+             'quarter_end': _on_or_before(sessions, month_ends[quarterly]),
+             'rebalance': _on_or_before(sessions, third_fridays[quarterly])}
+    for values in table.values():
+        values.setflags(write=False)
+    return table
+
+
+def day_ordinals(dates):
+    """
+    returns dates as integer days since 1970-01-01
+    """
+    return np.asarray(pd.DatetimeIndex(dates).values,
+                      dtype='datetime64[D]').astype('int64')
+
+
+def _events(event, days=()):
+    """
+    returns sorted day ordinals of event over at least FIRST_YEAR to
+    LAST_YEAR, and over every year of days
+    """
+    if event not in EVENTS:
+        raise ValueError(f"event must be one of {', '.join(EVENTS)}")
+    first, last = FIRST_YEAR, LAST_YEAR
+    if len(days):
+        years = np.array([np.min(days), np.max(days)],
+                         dtype='datetime64[D]').astype('datetime64[Y]')
+        first = min(first, int(years[0].astype('int64')) + 1970)
+        last = max(last, int(years[1].astype('int64')) + 1970)
+    return _table(first, last)[event]
+
+
+def event_days(event, start=None, end=None):
+    """
+    returns sorted integer day ordinals of event from start to end
+    event is one of EVENTS: NYSE sessions and holidays, monthly and weekly
+    option expiries, quarter ends and index rebalance dates
+    """
+    bounds = day_ordinals([date for date in (start, end) if date is not None])
+    days = _events(event, bounds)
+    low = (np.searchsorted(days, day_ordinals([start])[0])
+           if start is not None else 0)
+    high = (np.searchsorted(days, day_ordinals([end])[0], side='right')
+            if end is not None else len(days))
+    return days[low:high]
+
+
+def event_dates(event, start=None, end=None):
+    """
+    returns DatetimeIndex of event from start to end, see event_days
+    """
+    return pd.DatetimeIndex(event_days(event, start, end).astype(
+        'datetime64[D]').astype('datetime64[ns]'), name='date')
+
+
+def is_event(dates, event):
+    """
+    returns boolean mask of dates falling on event, one searchsorted over
+    the precomputed day ordinals for any number of dates
+    """
+    days = day_ordinals(dates)
+    events = _events(event, days)
+    rows = np.minimum(np.searchsorted(events, days), len(events) - 1)
+    return events[rows] == days
+
+
+def event_rows(data, event):
+    """
+    returns rows of a date indexed frame falling on event, e.g. monthly
+    expiries of a Stock's data or quarter ends of a closes panel
+    """
+    return data[is_event(data.index, event)]